@@ -1,4 +1,4 @@
-# Add the polygon of the 'bridge hull' as wkt
+# Add the polygon of the 'bridge hull' as a shapely geometry
 #
 # Created by: Andy Carter, PE
 # Created - 2022.11.11
@@ -21,7 +21,12 @@ import os
 # ************************************************************
 
 # ----------------------------------------------------
-def fn_add_hull_geometry_early(gdf_appended_ln_w_hull_id, int_class):
+def fn_add_hull_geometry_early(gdf_appended_ln_w_hull_id, int_class, dict_hull_gdf=None):
+    
+    # dict_hull_gdf - optional: hull geodataframes already read and reprojected
+    # to the crs of gdf_appended_ln_w_hull_id, keyed by the hull shapefile path
+    if dict_hull_gdf is None:
+        dict_hull_gdf = {}
     
     # option to turn off the SettingWithCopyWarning
     pd.set_option('mode.chained_assignment', None)
@@ -30,8 +35,9 @@ def fn_add_hull_geometry_early(gdf_appended_ln_w_hull_id, int_class):
     
     gdf_mjr_axis_ln = gdf_appended_ln_w_hull_id
     
-    # create a new coloumn
-    gdf_mjr_axis_ln['hull_wkt'] = ''
+    # hull polygon (shapely geometry) for each row index - kept as geometry
+    # objects, not wkt text, as they are used directly to center the major axis
+    dict_hull_geom = {}
     
     # get list of the unique 'file_path' in gdf_mjr_axis_ln
     list_unique_filepath = gdf_mjr_axis_ln.file_path.unique().tolist()
@@ -54,22 +60,30 @@ def fn_add_hull_geometry_early(gdf_appended_ln_w_hull_id, int_class):
         # combine the header and the filename
         str_filepath_hulls = os.path.join(str_root_path, str_filename)
         
-        if os.path.exists(str_filepath_hulls):
+        if str_filepath_hulls in dict_hull_gdf:
+            # already read and reprojected by the caller
+            gdf_hulls_per_file_local_prj = dict_hull_gdf[str_filepath_hulls]
+        elif os.path.exists(str_filepath_hulls):
             gdf_hulls_per_file = gpd.read_file(str_filepath_hulls)
             
             # reproject gdf_hulls_per_file to gdf_mjr_axis_ln crs
             gdf_hulls_per_file_local_prj = gdf_hulls_per_file.to_crs(gdf_mjr_axis_ln.crs)
+            dict_hull_gdf[str_filepath_hulls] = gdf_hulls_per_file_local_prj
+        else:
+            gdf_hulls_per_file_local_prj = None
+        
+        if gdf_hulls_per_file_local_prj is not None:
+            # hull geometry of every row in this file at once
+            list_hull_index = gdf_majr_axis_ln_filepath['hull_idx'].astype(int).tolist()
+            list_hull_geom = gdf_hulls_per_file_local_prj.geometry.loc[list_hull_index].tolist()
             
-            for index, row in gdf_majr_axis_ln_filepath.iterrows():
-                int_hull_index = int(row['hull_idx'])
-                geom = gdf_hulls_per_file_local_prj.loc[int_hull_index]['geometry']
-                str_hull_geom = str(geom.wkt)
-                
-                # append the hull_wkt
-                gdf_mjr_axis_ln.at[index, 'hull_wkt'] = str_hull_geom
+            dict_hull_geom.update(zip(gdf_majr_axis_ln_filepath.index, list_hull_geom))
         else:
             pass
     
+    # create a new coloumn (None where no hull was found)
+    gdf_mjr_axis_ln['hull_geom'] = [dict_hull_geom.get(index) for index in gdf_mjr_axis_ln.index]
+    
     print('+-----------------------------------------------------------------+')
     
     return(gdf_mjr_axis_ln)
@@ -8,11 +8,10 @@
 # tx-bridge - 07 - seventh processing script
 # Uses the 'pdal' conda environment
 
-# TODO - 2022.06.17 -  SettingWithCopyWarning Warning override
-
 # ************************************************************
 import argparse
 import geopandas as gpd
+import shapely
 import shapely.geometry
 import pandas as pd
 import numpy as np
@@ -21,8 +20,6 @@ import os
 
 import time
 import datetime
-
-import warnings
 # ************************************************************
 
 
@@ -37,6 +34,30 @@ def is_valid_file(parser, arg):
 # ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 
 
+# ----------------------------------------------
+def fn_read_osm_lines(str_osm_line_path):
+    # read the OpenStreetMap lines ('name', 'ref' and geometry only)
+    # a GeoParquet copy is cached alongside the shapefile on first read
+    # and is used on later reads while it is newer than the shapefile
+    str_osm_parquet_path = os.path.splitext(str_osm_line_path)[0] + '.parquet'
+    
+    if os.path.exists(str_osm_parquet_path) and \
+        os.path.getmtime(str_osm_parquet_path) >= os.path.getmtime(str_osm_line_path):
+        gdf_osm_lines = gpd.read_parquet(str_osm_parquet_path,
+                                         columns=["name", "ref", "geometry"])
+    else:
+        gdf_osm_lines = gpd.read_file(str_osm_line_path,
+                                      engine="pyogrio",
+                                      columns=["name", "ref"])
+        
+        gdf_osm_lines.to_parquet(str_osm_parquet_path,
+                                 compression="zstd",
+                                 row_group_size=100000)
+        
+    return(gdf_osm_lines)
+# ----------------------------------------------
+
+
 # ..........................................................
 def fn_assign_osm_names_major_axis(str_osm_line_path,str_mjr_axis_shp_path,str_output_dir,flt_perct_on_line,flt_offset):
     
@@ -60,71 +81,62 @@ def fn_assign_osm_names_major_axis(str_osm_line_path,str_mjr_axis_shp_path,str_o
     print("  ---[r]   Optional: RATIO QUERRY LOCATION: " + str(flt_perct_on_line) )
     print("===================================================================")
     
-    # ignore all warnings
-    warnings.simplefilter(action='ignore', category=Warning)
-    
     # create the output directory if it does not exist
     os.makedirs(str_output_dir, exist_ok=True)
     
     # read the mjr axis lines
-    gdf_mjr_axis_ln = gpd.read_file(str_mjr_axis_shp_path)
-    
-    # create Geodataframe for a point on each line
-    gdf_mjr_axis_pt = gpd.read_file(str_mjr_axis_shp_path)
+    gdf_mjr_axis_ln = gpd.read_file(str_mjr_axis_shp_path, engine="pyogrio")
     
-    # geopandas point on of mjr axis lines
-    gdf_mjr_axis_pt['geometry'] = gdf_mjr_axis_pt.geometry.interpolate(flt_perct_on_line, normalized = True)
+    # point on each of the mjr axis lines - single vectorized shapely call
+    arr_mjr_axis_pt = shapely.line_interpolate_point(gdf_mjr_axis_ln.geometry.values,
+                                                     flt_perct_on_line,
+                                                     normalized = True)
     
-    bbox = gdf_mjr_axis_pt.bounds + [-flt_offset, -flt_offset, flt_offset, flt_offset]
+    # create Geodataframe for a point on each line
+    gdf_mjr_axis_pt = gpd.GeoDataFrame(gdf_mjr_axis_ln.drop(columns='geometry'),
+                                       geometry=arr_mjr_axis_pt,
+                                       crs=gdf_mjr_axis_ln.crs)
     
     # --- get openstreetmap data ---
     print('Reading the OpenStreetMap data...')
-    gdf_edges_road_rail = gpd.read_file(str_osm_line_path)
-    
-    print('Determining tranportation names...')
-    hits = bbox.apply(lambda row: list(gdf_edges_road_rail.sindex.intersection(row)), axis=1)
-
-    df_tmp = pd.DataFrame({
-        # index of points table
-        "pt_idx": np.repeat(hits.index, hits.apply(len)),
-        # ordinal position of line - access via iloc later
-        "line_i": np.concatenate(hits.values)
-    })
-    
-    # join back to the lines on line_i; we use reset_index() to give us the ordinal position of each line
-    df_tmp = df_tmp.join(gdf_edges_road_rail.reset_index(drop=True), on="line_i")
-    
-    # join back to the original points to get their geometry
-    # rename the point geometry as "point"
-    df_tmp = df_tmp.join(gdf_mjr_axis_pt.geometry.rename("point"), on="pt_idx")
-    
-    # convert back to a GeoDataFrame
-    df_tmp = gpd.GeoDataFrame(df_tmp, geometry="geometry", crs=gdf_mjr_axis_pt.crs)
-    
-    df_tmp["snap_dist"] = df_tmp.geometry.distance(gpd.GeoSeries(df_tmp.point))
+    gdf_edges_road_rail = fn_read_osm_lines(str_osm_line_path)
     
-    # discard any lines that are greater than tolerance from points
-    df_tmp = df_tmp.loc[df_tmp.snap_dist <= flt_offset]
+    # sort the edges along a Hilbert curve before the spatial index is built
+    # so that nearby edges are stored in nearby leaves of the tree
+    arr_hilbert = gdf_edges_road_rail.geometry.hilbert_distance(level=16).to_numpy()
+    gdf_edges_road_rail = gdf_edges_road_rail.iloc[np.argsort(arr_hilbert)].reset_index(drop=True)
     
-    # sort on ascending snap distance, so that closest goes to top
-    df_tmp = df_tmp.sort_values(by=["snap_dist"])
-    
-    # group by the index of the points and take the first, which is the closest line 
-    gdf_closest = df_tmp.groupby("pt_idx").first()
-    
-    # construct a GeoDataFrame of the closest lines
-    gdf_closest = gpd.GeoDataFrame(gdf_closest, geometry="geometry")
-    
-    gdf_mjr_axis_name = gdf_closest[["name", "ref"]]
+    print('Determining tranportation names...')
+    # nearest line to each point in a single spatial index call
+    # returns aligned arrays of (point position, line position)
+    # points without a line within the offset are not returned
+    arr_pt_i, arr_line_i = gdf_edges_road_rail.sindex.nearest(gdf_mjr_axis_pt.geometry.values,
+                                                              return_all=False,
+                                                              max_distance=flt_offset)
+    
+    # line attributes taken by ordinal position of the nearest line
+    df_closest = pd.DataFrame({
+        "name": gdf_edges_road_rail["name"].to_numpy()[arr_line_i],
+        "ref": gdf_edges_road_rail["ref"].to_numpy()[arr_line_i]
+    }, index=gdf_mjr_axis_pt.index[arr_pt_i])
     
     # replace the name 'None' with the 'ref' value
-    gdf_mjr_axis_name.name.fillna(gdf_mjr_axis_name.ref, inplace=True)
+    arr_name = df_closest["name"].to_numpy()
+    arr_ref = df_closest["ref"].to_numpy()
+    df_closest["name"] = np.where(pd.isna(arr_name), arr_ref, arr_name)
+    
+    gdf_mjr_axis_name = df_closest[["name", "ref"]]
     
     # left join the lines with the names
     gdf_mjr_axis_ln = gdf_mjr_axis_ln.join(gdf_mjr_axis_name)
     
-    str_file_shp_to_write = os.path.join(str_output_dir, 'flip_mjr_axis_w_name_ln.shp')
-    gdf_mjr_axis_ln.to_file(str_file_shp_to_write)
+    # FlatGeobuf - single file, batched write through pyogrio
+    # no spatial index so that the features keep the major axis order
+    str_file_fgb_to_write = os.path.join(str_output_dir, 'flip_mjr_axis_w_name_ln.fgb')
+    gdf_mjr_axis_ln.to_file(str_file_fgb_to_write,
+                            driver="FlatGeobuf",
+                            engine="pyogrio",
+                            SPATIAL_INDEX="NO")
 
 # ..........................................................
 
@@ -14,34 +14,43 @@ import argparse
 import geopandas as gpd
 import pandas as pd
 
-from shapely import wkt
-from shapely.wkt import loads
+import shapely
 from shapely.geometry import LineString, Polygon
 from shapely.ops import split
 
+import xarray as xr
+from pyproj import CRS, Transformer
 import rioxarray as rio
 from rasterio.io import MemoryFile
 from rioxarray.merge import merge_arrays
 from rasterio.errors import RasterioIOError
+from rioxarray.exceptions import NoDataInBounds
 
 import numpy as np
 import math
-from scipy.signal import savgol_filter
+from scipy.signal import savgol_coeffs, fftconvolve
+from scipy.optimize import minimize_scalar
 
 import os
 import tqdm
+from functools import lru_cache
 
 import time
 import datetime
 
 import json
+import pyarrow as pa
+import pyarrow.parquet as pq
 import configparser
 import rtree
+import atexit
 
-import urllib.request
+import requests
+from requests.adapters import HTTPAdapter
 
 import multiprocessing as mp
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -59,6 +68,14 @@ from generate_kml import fn_generate_kml
 
 # ************************************************************
 
+# one pooled (keep-alive) http session per process for the WCS requests
+SESSION_WCS = requests.Session()
+SESSION_WCS.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=3))
+SESSION_WCS.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=3))
+
+# rtree indexes of the ground dem tiles - opened once per process (read only)
+DICT_RTREE_INDEX = {}
+
 
 # ````````````````````````````````````````
 def fn_json_from_ini(str_ini_path):
@@ -84,11 +101,26 @@ def fn_filelist(source, tpl_extenstion):
     #   source = path to walk
     #   tpl_extenstion = tuple of the extensions to find (Example: (.tig, .jpg))
     #   str_dem_path = path of the dem that needs to be converted
+    # os.scandir - the file type comes from the directory entry (no extra stat)
+    tpl_extenstion = tuple(str_ext.lower() for str_ext in tpl_extenstion)
+    
     matches = []
-    for root, dirnames, filenames in os.walk(source):
-        for filename in filenames:
-            if filename.endswith(tpl_extenstion):
-                matches.append(os.path.join(root, filename))
+    list_dirs_to_scan = [source]
+    while list_dirs_to_scan:
+        list_subdirs = []
+        try:
+            with os.scandir(list_dirs_to_scan.pop()) as it_entries:
+                for entry in it_entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        list_subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(tpl_extenstion):
+                        matches.append(entry.path)
+        except OSError:
+            # like os.walk - skip folders that can't be read (or don't exist)
+            continue
+        
+        # same (top-down) order as os.walk
+        list_dirs_to_scan.extend(reversed(list_subdirs))
     return matches
 # ````````````````````````````````````````
 
@@ -129,13 +161,60 @@ def fn_gdf_point_on_line(flt_perct_on_line, gdf_line_input):
     # create Geodataframe for a point on each line
     gdf_pt = gdf_line_input.copy()
 
-    # geopandas point on of mjr axis lines
-    gdf_pt['geometry'] = gdf_line_input.geometry.interpolate(flt_perct_on_line, normalized = True)
+    # point on each of the mjr axis lines - one vectorized shapely (GEOS) call
+    arr_pt = shapely.line_interpolate_point(np.asarray(gdf_line_input.geometry.values),
+                                            flt_perct_on_line,
+                                            normalized = True)
+    gdf_pt['geometry'] = gpd.GeoSeries(arr_pt, index=gdf_line_input.index, crs=gdf_line_input.crs)
     
     return(gdf_pt)
 # ---------------------------------------------
 
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+@lru_cache(maxsize=64)
+def fn_savgol_weights(int_window, int_polyorder=2):
+    # Savitzky-Golay weights for a window length - computed once per window
+    # returns the convolution coefficients for the interior points and the
+    # least-squares polynomial fit matrices for the leading and trailing points
+    # (same as the 'interp' edge mode of scipy.signal.savgol_filter)
+    arr_coeffs = savgol_coeffs(int_window, int_polyorder)
+    
+    arr_vander = np.vander(np.arange(int_window, dtype=float), int_polyorder + 1)
+    arr_fit = arr_vander @ np.linalg.pinv(arr_vander)
+    
+    int_half = int_window // 2
+    return(arr_coeffs, arr_fit[:int_half], arr_fit[-int_half:])
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def fn_savgol_filter(list_y, int_window):
+    # savgol filter (polyorder = 2) using the cached weights
+    arr_y = np.asarray(list_y, dtype=float)
+    
+    if int_window < 3 or int_window > arr_y.size:
+        raise ValueError('window length must be odd, >= 3 and <= the number of points')
+    
+    arr_coeffs, arr_fit_head, arr_fit_tail = fn_savgol_weights(int_window)
+    int_half = int_window // 2
+    
+    arr_smooth = np.empty_like(arr_y)
+    
+    # interior points - direct convolution, FFT for long windows
+    if int_window > 200:
+        arr_smooth[int_half:arr_y.size - int_half] = fftconvolve(arr_y, arr_coeffs, mode='valid')
+    else:
+        arr_smooth[int_half:arr_y.size - int_half] = np.convolve(arr_y, arr_coeffs, mode='valid')
+    
+    # leading and trailing points - polynomial fit of the first / last window
+    arr_smooth[:int_half] = arr_fit_head @ arr_y[:int_window]
+    arr_smooth[arr_y.size - int_half:] = arr_fit_tail @ arr_y[-int_window:]
+    
+    return(arr_smooth)
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 def fn_get_smooth_deck_and_ground_profile(gdf):
     
@@ -155,7 +234,7 @@ def fn_get_smooth_deck_and_ground_profile(gdf):
         int_window += 1
 
     try:
-        w_deck = savgol_filter(y_deck, int_window, 2)
+        w_deck = fn_savgol_filter(y_deck, int_window)
     except:
         w_deck = y_deck
     
@@ -194,22 +273,29 @@ def fn_get_smooth_deck_and_ground_profile(gdf):
 
 
 # .............................................
-def fn_get_ground_dem_from_usgs_service(shp_mjr_axis_ar_buffer_lambert, b_is_feet, crs_lines):
+def fn_get_ground_dem_from_usgs_service(shp_mjr_axis_ar_buffer_lambert):
     
     # TODO - 2022.11.15 - Service will retun strange ground (0 elevations and nan??)
     
     int_resolution = 1 # requested resolution in lambert units - meters
+    flt_max_extent_full_res = 2000 # buffers larger than this are requested at 2x the resolution
     
     # the geometry from the requested polygon as wellKnownText
     boundary_geom_WKT = shp_mjr_axis_ar_buffer_lambert
 
     # the bounding box of the requested lambert polygon
     b = boundary_geom_WKT.bounds
+    
+    # for long bridges a 1 meter grid is wasted - request a coarser grid
+    # (payload drops by the square of the scale)
+    if max(b[2] - b[0], b[3] - b[1]) > flt_max_extent_full_res:
+        int_resolution = 2
 
-    # convert the bounding coordinates to integers
-    list_int_b = []
-    for i in b:
-        list_int_b.append(int(i//1))
+    # snap the bounding coordinates outward to the requested grid (integers)
+    list_int_b = [int(math.floor(b[0] / int_resolution)) * int_resolution,
+                  int(math.floor(b[1] / int_resolution)) * int_resolution,
+                  int(math.ceil(b[2] / int_resolution)) * int_resolution,
+                  int(math.ceil(b[3] / int_resolution)) * int_resolution]
 
     int_tile_x = list_int_b[2] - list_int_b[0]
     int_tile_y = list_int_b[3] - list_int_b[1]
@@ -233,31 +319,55 @@ def fn_get_ground_dem_from_usgs_service(shp_mjr_axis_ar_buffer_lambert, b_is_fee
 
     str_url = str_URL_header + str_URL_query_1 + str_URL_query_bbox + str_URL_query_dim
 
-    # url request to get terrain
-    http_response_raster = urllib.request.urlopen(str_url)
+    # url request to get terrain (reuses the pooled connection)
+    # the response is streamed into the in-memory GDAL file in chunks so the
+    # whole GeoTIFF is never held as an extra python bytes object
+    with SESSION_WCS.get(str_url, timeout=30, stream=True) as http_response_raster:
+        http_response_raster.raise_for_status()
+
+        with MemoryFile() as memfile:
+            for byte_chunk in http_response_raster.iter_content(chunk_size=1048576):
+                memfile.write(byte_chunk)
 
-    # convert the response to bytes
-    byte_response_raster = http_response_raster.read()
+            with memfile.open() as ground_terrain_src:
 
-    with MemoryFile(byte_response_raster) as memfile:
-        with memfile.open() as ground_terrain_src:
+                # read the DEM as a "Rioxarray" (left in lambert - the profile
+                # points are transformed to the DEM's crs when sampled)
+                # as float32 - masking can promote integer rasters to float64
+                ground_dem = rio.open_rasterio(ground_terrain_src, masked=True).squeeze().astype('float32', copy=False).load()
+                
+    return(ground_dem)
+# .............................................
 
-            # read the DEM as a "Rioxarray"
-            ground_dem = rio.open_rasterio(ground_terrain_src).squeeze()
 
-            # reproject the raster to the same projection as the road
-            ground_dem_local_proj = ground_dem.rio.reproject(crs_lines, nodata = np.nan)
+# .............................................
+@lru_cache(maxsize=4)
+def fn_open_cog_dem(str_cog_dem_path):
+    # open the ground COG (lazy, dask backed) - once per worker process
+    # the header is parsed once and each bridge only reads its own window
+    xar_cog_dem = rio.open_rasterio(
+        filename=str_cog_dem_path,
+        chunks='auto',
+        parse_coordinates=True,
+        masked=True)
+    
+    return(xar_cog_dem)
+# .............................................
+
 
-            if b_is_feet:
-                # scale the raster from meters to feet
-                ground_dem_local_proj = ground_dem_local_proj * 3.28084
-                
-    return(ground_dem_local_proj)
+# .............................................
+def fn_init_profile_worker(str_input_cog_ground_dem):
+    # initializer of each pool worker - open the ground dem source up front
+    if str_input_cog_ground_dem != 'None':
+        if str_input_cog_ground_dem[-3:] == "tif":
+            fn_open_cog_dem(str_input_cog_ground_dem)
+        else:
+            fn_get_rtree_index(str_input_cog_ground_dem)
 # .............................................
 
 
 # .............................................
-def fn_get_ground_dem_from_provided_cog(shp_mjr_axis_ar_buffer_lambert, b_is_feet, crs_line, str_cog_dem_path):
+def fn_get_ground_dem_from_provided_cog(shp_mjr_axis_ar_buffer_lambert, str_cog_dem_path):
     
     # added MAC - 2023.07.24 - to allow for local COG file
 
@@ -267,34 +377,91 @@ def fn_get_ground_dem_from_provided_cog(shp_mjr_axis_ar_buffer_lambert, b_is_fee
     # the bounding box of the requested lambert polygon
     b = boundary_geom_WKT.bounds
 
-    # create rio xarray of the clipped boundary
-    xar_dem = rio.open_rasterio(
-        filename=str_cog_dem_path,
+    # create rio xarray of the clipped boundary (from the already open COG)
+    xar_dem = fn_open_cog_dem(str_cog_dem_path).rio.clip_box(minx=b[0], miny=b[1], maxx=b[2], maxy=b[3]).astype('float32', copy=False)
+    
+    # read the DEM as a "Rioxarray" (left in the COG's crs)
+    ground_dem = xar_dem.squeeze()
+   
+    return(ground_dem)
+# .............................................
+
+
+# .............................................
+@lru_cache(maxsize=16)
+def fn_open_tile(str_dem_filepath, flt_mtime):
+    # open a ground dem tile lazily (dask - no pixels are read here)
+    # cached per worker process - adjacent bridges often share the same tiles.
+    # Each entry is only an open file handle and its metadata, so the cache
+    # holds at most 16 handles per worker (not 16 tiles of pixels)
+    # flt_mtime is part of the cache key so a re-written tile is re-read
+    xar_input_dem = rio.open_rasterio(
+        filename=str_dem_filepath,
         chunks='auto',
         parse_coordinates=True,
-        masked=True).rio.clip_box(minx=b[0], miny=b[1], maxx=b[2], maxy=b[3])
+        masked=True).astype('float32', copy=False)
+    
+    return(xar_input_dem)
+# .............................................
+
+
+# .............................................
+def fn_get_tile_lambert(str_dem_filepath, flt_mtime, tup_bounds_lambert):
+    # window of a ground dem tile over the bridge buffer, reprojected to
+    # lambert (EPSG:3857) - kept as float32
+    # only the window is read and reprojected (not the whole tile), so the
+    # pixels held per worker are those of the current bridge's buffer
+    
+    # pad the window (lambert meters) so that the reprojected window still
+    # covers the buffer's bounds
+    flt_pad = 50
+    
+    xar_input_dem = fn_open_tile(str_dem_filepath, flt_mtime)
     
+    # TODO - 2023.09.20 - run 78 reads a xar with no crs?
+    # and therefore can't reproject
+    xar_input_dem_window = xar_input_dem.rio.clip_box(minx=tup_bounds_lambert[0] - flt_pad,
+                                                      miny=tup_bounds_lambert[1] - flt_pad,
+                                                      maxx=tup_bounds_lambert[2] + flt_pad,
+                                                      maxy=tup_bounds_lambert[3] + flt_pad,
+                                                      crs="EPSG:3857")
+    
+    xar_input_dem_lambert = xar_input_dem_window.rio.reproject("EPSG:3857")
+
     # read the DEM as a "Rioxarray"
-    ground_dem = xar_dem.squeeze()
+    ground_dem = xar_input_dem_lambert.squeeze()
+    
+    return(ground_dem)
+# .............................................
 
-    # reproject the raster to the same projection as the road
-    ground_dem_local_proj = ground_dem.rio.reproject(crs_line, nodata = np.nan)
 
-    if b_is_feet:
-        # scale the raster from meters to feet
-        ground_dem_local_proj = ground_dem_local_proj * 3.28084
-   
-    return(ground_dem_local_proj)
+# .............................................
+def fn_close_rtree_indexes():
+    # close the cached rtree indexes (at process exit)
+    for itree in DICT_RTREE_INDEX.values():
+        itree.close()
+    DICT_RTREE_INDEX.clear()
 # .............................................
 
 
 # .............................................
-def fn_get_ground_dem_rtree(shp_mjr_axis_ar_buffer_lambert, b_is_feet, crs_line, str_rtree_path):
+def fn_get_rtree_index(str_rtree_path):
+    # open the rtree index on first use and reuse it for the following bridges
+    if str_rtree_path not in DICT_RTREE_INDEX:
+        if not DICT_RTREE_INDEX:
+            atexit.register(fn_close_rtree_indexes)
+        DICT_RTREE_INDEX[str_rtree_path] = rtree.index.Index(str_rtree_path)
+    return(DICT_RTREE_INDEX[str_rtree_path])
+# .............................................
+
+
+# .............................................
+def fn_get_ground_dem_rtree(shp_mjr_axis_ar_buffer_lambert, str_rtree_path):
     # added MAC - 2023.08.29
     # revised - 2023.09.20 - error trap of 'bad' data
 
-    # load the rtree index
-    itree = rtree.index.Index(str_rtree_path)
+    # load the rtree index (cached - not closed per bridge)
+    itree = fn_get_rtree_index(str_rtree_path)
 
     list_intersecting_dem_paths = []
     list_source_crs = []
@@ -302,7 +469,6 @@ def fn_get_ground_dem_rtree(shp_mjr_axis_ar_buffer_lambert, b_is_feet, crs_line,
     for int_count, tup_bounds, filepath, str_crs in hits:
         list_intersecting_dem_paths.append(filepath)
         list_source_crs.append(str_crs)
-    itree.close()
 
     b = shp_mjr_axis_ar_buffer_lambert.bounds
     
@@ -311,74 +477,131 @@ def fn_get_ground_dem_rtree(shp_mjr_axis_ar_buffer_lambert, b_is_feet, crs_line,
     if len(list_intersecting_dem_paths) > 0:
         for str_dem_filepath in list_intersecting_dem_paths:
             try:
-                xar_input_dem = rio.open_rasterio(
-                    filename=str_dem_filepath,
-                    chunks='auto',
-                    parse_coordinates=True,
-                    masked=True)
-                
-                # TODO - 2023.09.20 - run 78 reads a xar with no crs?
-                # and therefore can't reproject
-                xar_input_dem_lambert  = xar_input_dem.rio.reproject("EPSG:3857")
-    
-                # read the DEM as a "Rioxarray"
-                ground_dem = xar_input_dem_lambert.squeeze()
+                ground_dem = fn_get_tile_lambert(str_dem_filepath,
+                                                 os.path.getmtime(str_dem_filepath),
+                                                 b)
                 list_xar_dem.append(ground_dem)
-            except RasterioIOError:
+            except (RasterioIOError, OSError):
                 # added 2023.09.20 - Some img can't be read by rasterio (corrupt files)
                 continue # continue to next file if error occurs
+            except NoDataInBounds:
+                # the tile's extent (in the rtree) touches the buffer but has no cells in it
+                continue
 
         if len(list_xar_dem) > 0:
-            # merge the list of rioxarrays
-            ground_dem_lambert = merge_arrays(list_xar_dem)
-            
-            # reproject rioxarray from lambert to input projection
-            ground_dem_local_proj = ground_dem_lambert.rio.reproject(crs_line)
-            
-            if b_is_feet:
-                # scale the raster from meters to feet
-                ground_dem_local_proj = ground_dem_local_proj * 3.28084
+            # merge the list of rioxarrays - each is already a window over the
+            # buffer (left in lambert - no reprojection to the line's crs)
+            ground_dem = merge_arrays(list_xar_dem)
         else:
-            ground_dem_local_proj = None
+            ground_dem = None
     else:
-        ground_dem_local_proj = None
+        ground_dem = None
             
-    return(ground_dem_local_proj)
+    return(ground_dem)
+# .............................................
+
+
+# .............................................
+@lru_cache(maxsize=16)
+def fn_get_transformer(str_crs_from, str_crs_to):
+    # pyproj transformer between two crs - built once per pair
+    return(Transformer.from_crs(str_crs_from, str_crs_to, always_xy=True))
+# .............................................
+
+
+# .............................................
+def fn_sample_dem_nearest(xar_dem, arr_x, arr_y, str_crs_pts=None):
+    
+    # value of the nearest cell of the rioxarray at each (x, y) point
+    # single vectorized selection instead of one .sel() per point
+    # if str_crs_pts is given, the points are transformed into the dem's crs
+    # (O(points) - instead of reprojecting the whole raster to the points' crs)
+    if str_crs_pts is not None and xar_dem.rio.crs is not None:
+        str_crs_dem = xar_dem.rio.crs.to_wkt()
+        if CRS.from_user_input(str_crs_pts) != CRS.from_wkt(str_crs_dem):
+            arr_x, arr_y = fn_get_transformer(str(str_crs_pts), str_crs_dem).transform(arr_x, arr_y)
+    
+    xar_sampled = xar_dem.sel(x = xr.DataArray(arr_x, dims='pt'),
+                              y = xr.DataArray(arr_y, dims='pt'),
+                              method="nearest")
+    
+    arr_values = np.asarray(xar_sampled.values, dtype=float)
+    
+    if arr_values.size == len(arr_x):
+        # drop a single 'band' dimension if present
+        arr_values = arr_values.reshape(-1)
+    else:
+        # multi-band raster - no single value per point
+        arr_values = np.full(len(arr_x), np.nan)
+        
+    return(arr_values)
 # .............................................
 
 
+# --------------------------------------------
+def fn_get_deck_spike_mask(arr_grnd, arr_deck, flt_spike_tol):
+    # boolean mask of the deck points to blank (set to nan) as spikes
+    #   arr_grnd, arr_deck = ground and deck elevations along the profile
+    #   flt_spike_tol = deck jump (units) that is not treated as a spike
+    #
+    # 'assess' points are between the first and last point where the deck is
+    # off the ground and have the deck on the ground. They come in runs of
+    # consecutive points:
+    #   - a run's first point is a spike if the deck jumps to either neighbor
+    #   - if the first point is a spike, the whole run is blanked
+    #   - otherwise only the run's last point is tested for a jump
+    int_n = arr_deck.size
+    arr_ind_vals = np.flatnonzero(arr_grnd != arr_deck)
+    int_first, int_last = arr_ind_vals[0], arr_ind_vals[-1]
+    
+    arr_is_assess = np.zeros(int_n + 1, dtype=bool) # extra False at the end (index -1)
+    arr_is_assess[int_first:int_last] = arr_grnd[int_first:int_last] == arr_deck[int_first:int_last]
+    arr_is_assess_prev = np.roll(arr_is_assess, 1)[:int_n]
+    arr_is_assess_next = np.roll(arr_is_assess, -1)[:int_n]
+    arr_is_assess = arr_is_assess[:int_n]
+    
+    # deck jump to the previous and next point
+    arr_jump_prev = np.abs(arr_deck - np.roll(arr_deck, 1))
+    arr_jump_next = np.abs(arr_deck - np.roll(arr_deck, -1))
+    
+    # same nan handling as the builtin max() of (prev, next)
+    arr_jump = np.where(arr_jump_next > arr_jump_prev, arr_jump_next, arr_jump_prev)
+    with np.errstate(invalid='ignore'):
+        arr_is_jump = ~(arr_jump < flt_spike_tol)
+    
+    arr_is_run_start = arr_is_assess & ~arr_is_assess_prev
+    arr_is_run_end = arr_is_assess & ~arr_is_assess_next & arr_is_assess_prev
+    
+    # does the run that each point belongs to start with a spike
+    arr_run_id = np.cumsum(arr_is_run_start)
+    arr_is_run_blanked = np.concatenate(([False], arr_is_jump[arr_is_run_start]))[arr_run_id]
+    
+    arr_is_spike = arr_is_assess & (arr_is_run_blanked | (arr_is_run_end & arr_is_jump))
+    
+    return(arr_is_spike)
+# --------------------------------------------
+
+
 # --------------------------------------------
 def fn_fix_ground_spikes(gdf_input):
     
     # with asitance from Dr. Joe Rungee (joe.rungee@stantec.com) - 2023.08.31
-    list_selected_columns = ['h_distance', 'elev_grnd', 'elev_deck']
-    df_fix = gdf_input[list_selected_columns].copy()
-    df2_fix = df_fix[df_fix['elev_grnd'] != df_fix['elev_deck']]
-    list_ind_vals =  df2_fix.index.to_list()
+    arr_grnd = gdf_input['elev_grnd'].to_numpy(dtype=float)
+    arr_deck = gdf_input['elev_deck'].to_numpy(dtype=float, copy=True)
     
-    assess = sorted(set(range(list_ind_vals[0],list_ind_vals[-1])) - set(list_ind_vals))
+    # note the hard coded value of 0.5 units
+    arr_deck[fn_get_deck_spike_mask(arr_grnd, arr_deck, 0.5)] = np.nan
     
-    for ind in assess:
-        if any(x not in assess for x in [ind-1, ind+1]):
-            # note the hard coded value of 0.5 units in the following code
-            if max(abs(df_fix['elev_deck'][ind]-df_fix['elev_deck'][ind-1]), abs(df_fix['elev_deck'][ind]-df_fix['elev_deck'][ind+1])) < 0.5:
-                continue
-            else:
-                df_fix.loc[ind, 'elev_deck'] = np.nan
-        elif math.isnan(df_fix.loc[ind-1, 'elev_deck']):
-            df_fix.loc[ind, 'elev_deck'] = np.nan
-        
-    df_fixed = df_fix.interpolate()
-        
-    # replace the coloumn from df_fixed['elev_deck'] to gdf_input
-    gdf_input['elev_deck'] = df_fixed['elev_deck']
+    # replace the coloumn with the interpolated deck
+    gdf_input['elev_deck'] = pd.Series(arr_deck, index=gdf_input.index).interpolate()
     
     return(gdf_input)
 # --------------------------------------------
 
 
 # *********************************************
-def fn_get_profile_gdf_on_major_axis_from_dems(shp_mjr_axis_ln,str_mjr_axis_ln_crs,ground_dem_local_proj,deck_dem_local_proj):
+def fn_get_profile_gdf_on_major_axis_from_dems(shp_mjr_axis_ln,str_mjr_axis_ln_crs,ground_dem,deck_dem,
+                                                flt_grnd_unit_conv=1.0):
     
     # option to turn off the SettingWithCopyWarning
     pd.set_option('mode.chained_assignment', None)
@@ -393,83 +616,46 @@ def fn_get_profile_gdf_on_major_axis_from_dems(shp_mjr_axis_ln,str_mjr_axis_ln_c
         #Get the length of the current road edge
         len_current_edge = fn_distance(start_coords[0],end_coords[0],start_coords[1],end_coords[1])
 
-        x_ls = [start_coords[0]]
-        y_ls = [start_coords[1]]
-
         # create a point at a requested interval - sort of
-        n_points = int(len_current_edge // flt_xs_sample_interval)
+        # (always at least the start point of the edge)
+        n_points = max(int(len_current_edge // flt_xs_sample_interval), 1)
 
-        if n_points > 0:
-            for j in np.arange(1, n_points):
-                x_dist = end_coords[0] - start_coords[0]
-                y_dist = end_coords[1] - start_coords[1]
-                point = [(start_coords[0] + (x_dist/(n_points))*j), (start_coords[1] + (y_dist/(n_points))*j)]
-                x_ls.append(point[0])
-                y_ls.append(point[1])
+        arr_x = np.linspace(start_coords[0], end_coords[0], n_points, endpoint=False)
+        arr_y = np.linspace(start_coords[1], end_coords[1], n_points, endpoint=False)
 
         if total_length == 0: # on the first road edge
-            # Getting the station - horizontal distance
-            df = pd.DataFrame({'x': x_ls,'y': y_ls})
-            gdf = gpd.GeoDataFrame(df, geometry = gpd.points_from_xy(df.x, df.y))
-
-            gdf.crs = str_mjr_axis_ln_crs
-
-            gdf['h_distance'] = 0 # Intialize the variable in dataframe
-
-            for index2, row2 in gdf.iterrows():
-                gdf['h_distance'].loc[index2] = gdf.geometry[0].distance(gdf.geometry[index2])
-
-            gdf['elev_grnd'] = np.nan # Intialize the variable in dataframe
-            gdf['elev_deck'] = np.nan
-
-            for index3, row3 in gdf.iterrows():
-                # get the value at nearest point on the rioxarray
-                arr_np_raster_val = ground_dem_local_proj.sel(x = row3['x'], y = row3['y'], method="nearest").values
-                if arr_np_raster_val.size == 1:
-                    gdf['elev_grnd'].loc[index3] = arr_np_raster_val
-
-                arr_np_deck_val = deck_dem_local_proj.sel(x = row3['x'], y = row3['y'], method="nearest").values
-                if arr_np_deck_val.size == 1:
-                    gdf['elev_deck'].loc[index3] = arr_np_deck_val
-            del df
+            # points are colinear - station is the distance from the first point
+            list_arr_x = [arr_x]
+            list_arr_y = [arr_y]
+            list_arr_sta = [np.hypot(arr_x - arr_x[0], arr_y - arr_y[0])]
 
         else: #Any edge of road other than the first edge
             if i == (len(shp_mjr_axis_ln.coords)-2):
                 #This is the last edge on the road- add the last point
-                x_ls.append(end_coords[0])
-                y_ls.append(end_coords[1])
-
-            df_newEdge = pd.DataFrame({'x': x_ls,'y': y_ls})
-            gdf_newEdge = gpd.GeoDataFrame(df_newEdge, geometry = gpd.points_from_xy(df_newEdge.x, df_newEdge.y))
-            gdf_newEdge.crs = str_mjr_axis_ln_crs
-
-            gdf_newEdge['h_distance'] = 0 #Intialize the variable in dataframe
-
-            for index2, row2 in gdf_newEdge.iterrows():
-                gdf_newEdge['h_distance'].loc[index2] = gdf_newEdge.geometry[0].distance(gdf_newEdge.geometry[index2]) + total_length
-
-            gdf_newEdge['elev_grnd'] = np.nan
-            gdf_newEdge['elev_deck'] = np.nan
-
-            for index3, row3 in gdf_newEdge.iterrows():
-                # get the value at nearest point on the rioxarray
-                arr_np_raster_val = ground_dem_local_proj.sel(x = row3['x'], y = row3['y'], method="nearest").values
-                if arr_np_raster_val.size == 1:
-                    gdf_newEdge['elev_grnd'].loc[index3] = arr_np_raster_val
-
-                arr_np_deck_val = deck_dem_local_proj.sel(x = row3['x'], y = row3['y'], method="nearest").values
-                if arr_np_deck_val.size == 1:
-                    gdf_newEdge['elev_deck'].loc[index3] = arr_np_deck_val
+                arr_x = np.append(arr_x, end_coords[0])
+                arr_y = np.append(arr_y, end_coords[1])
 
-            gdf = pd.concat([gdf,gdf_newEdge], ignore_index=False)
-
-            del df_newEdge
-            del gdf_newEdge
+            # station is the distance from the first point of the edge plus prior edges
+            list_arr_x.append(arr_x)
+            list_arr_y.append(arr_y)
+            list_arr_sta.append(np.hypot(arr_x - arr_x[0], arr_y - arr_y[0]) + total_length)
 
         total_length += len_current_edge
 
-    # reset the index of the gdf
-    gdf = gdf.reset_index(drop=True)
+    # build the points of all the edges at once
+    arr_x = np.concatenate(list_arr_x)
+    arr_y = np.concatenate(list_arr_y)
+    
+    df = pd.DataFrame({'x': arr_x,'y': arr_y})
+    gdf = gpd.GeoDataFrame(df, geometry = gpd.points_from_xy(arr_x, arr_y), crs = str_mjr_axis_ln_crs)
+    gdf['h_distance'] = np.concatenate(list_arr_sta)
+    
+    del df
+    
+    # get the value at nearest point on the rioxarrays - all points at once
+    # flt_grnd_unit_conv scales only the sampled ground values (meters to feet)
+    gdf['elev_grnd'] = fn_sample_dem_nearest(ground_dem, arr_x, arr_y, str_mjr_axis_ln_crs) * flt_grnd_unit_conv
+    gdf['elev_deck'] = fn_sample_dem_nearest(deck_dem, arr_x, arr_y, str_mjr_axis_ln_crs)
     
     # fix the ground spiking
     gdf_fixed = fn_fix_ground_spikes(gdf)
@@ -478,78 +664,71 @@ def fn_get_profile_gdf_on_major_axis_from_dems(shp_mjr_axis_ln,str_mjr_axis_ln_c
 # *********************************************
 
 
+# ---------------------------------------------
+def fn_split_area_difference(flt_offset, shp_line, shp_polygon, str_side):
+    # difference in area of the two polygons created by splitting the
+    # hull with the line offset to one side - inf if it doesn't split in two
+    shp_offset_line = shp_line.parallel_offset(flt_offset, str_side)
+
+    # Try to split the polygon with the offset line
+    try:
+        split_polygons = split(shp_polygon, shp_offset_line)
+    except Exception as e:
+        return(float('inf'))
+
+    if len(split_polygons.geoms) == 2:
+        # Calculate the area difference between the split polygons
+        flt_area1 = split_polygons.geoms[0].area
+        flt_area2 = split_polygons.geoms[1].area
+
+        return(abs(flt_area1 - flt_area2))
+    else:
+        return(float('inf'))
+# ---------------------------------------------
+
+
 # ---------------------------------------------
 def fn_center_mjr_axis_on_hull(gdf_singlerow):
     
     # added 2023.09.05 to center the line on the hull polygon
-    shp_line = gdf_singlerow.iloc[0]['geometry']
-    shp_polygon = wkt.loads(gdf_singlerow.iloc[0]['hull_wkt'])
-    
-    flt_avg_width = float(gdf_singlerow.iloc[0]['avg_width'])
+    # get the row once - each .iloc[0] builds a new pandas series
+    sr_row = gdf_singlerow.iloc[0]
     
-    flt_best_difference = float('inf')
-    shp_best_split = None
-    shp_best_line = None
+    shp_line = sr_row['geometry']
+    shp_polygon = sr_row['hull_geom']
     
-    initial_value = 0.0  # Starting value
-    final_value = flt_avg_width  # Ending value
-    num_iterations = 100  # Number of iterations
+    flt_avg_width = float(sr_row['avg_width'])
     
+    flt_best_difference = float('inf')
     flt_best_offset_left = 0
+    flt_best_offset_right = 0
     
-    # ---------- find best left offset value
-    # Calculate the step size
-    step = (final_value - initial_value) / num_iterations
-    current_value = initial_value
-
-    for _ in range(num_iterations):
-        shp_offset_line = shp_line.parallel_offset(current_value, 'left')
-
-        # Try to split the polygon with the offset line
-        try:
-            split_polygons = split(shp_polygon, shp_offset_line)
-        except Exception as e:
-            pass
-
-        if len(split_polygons.geoms) == 2:
-            # Calculate the area difference between the split polygons
-            flt_area1 = split_polygons.geoms[0].area
-            flt_area2 = split_polygons.geoms[1].area
-
-            flt_difference = abs(flt_area1 - flt_area2)
-
-            if flt_difference < flt_best_difference:
-                flt_best_difference = flt_difference
-                flt_best_offset_left = current_value
-        current_value += step
+    # the area difference is (roughly) unimodal in the offset - a bounded
+    # (golden-section / Brent) search replaces a linear scan of 100 offsets per side
+    if flt_avg_width > 0:
+        dict_options = {'xatol': flt_avg_width / 1000}
         
-    # ---------- find best right offset value
-    # Calculate the step size
-    step = (final_value - initial_value) / num_iterations
-    current_value = initial_value
-
-    flt_best_offset_right = 0
-
-    for _ in range(num_iterations):
-        shp_offset_line = shp_line.parallel_offset(current_value, 'right')
-
-        # Try to split the polygon with the offset line
-        try:
-            split_polygons = split(shp_polygon, shp_offset_line)
-        except Exception as e:
-            pass
-
-        if len(split_polygons.geoms) == 2:
-            # Calculate the area difference between the split polygons
-            flt_area1 = split_polygons.geoms[0].area
-            flt_area2 = split_polygons.geoms[1].area
-
-            flt_difference = abs(flt_area1 - flt_area2)
-
-            if flt_difference < flt_best_difference:
-                flt_best_difference = flt_difference
-                flt_best_offset_right = current_value
-        current_value += step
+        # ---------- find best left offset value
+        result_left = minimize_scalar(fn_split_area_difference,
+                                      bounds = (0, flt_avg_width),
+                                      args = (shp_line, shp_polygon, 'left'),
+                                      method = 'bounded',
+                                      options = dict_options)
+        
+        if result_left.fun < flt_best_difference:
+            flt_best_difference = result_left.fun
+            flt_best_offset_left = result_left.x
+            
+        # ---------- find best right offset value
+        result_right = minimize_scalar(fn_split_area_difference,
+                                       bounds = (0, flt_avg_width),
+                                       args = (shp_line, shp_polygon, 'right'),
+                                       method = 'bounded',
+                                       options = dict_options)
+        
+        if result_right.fun < flt_best_difference:
+            flt_best_difference = result_right.fun
+            flt_best_offset_right = result_right.x
     
     # --- create the 'best' offset and assign to gdf of single row
     if flt_best_offset_right >= flt_best_offset_left:
@@ -585,16 +764,17 @@ def fn_populate_sta_ground_deck_elev(gdf_singlerow):
     # get crs of the input geodataframe
     str_mjr_axis_ln_crs = str(gdf_singlerow.crs)
     
-    # get variables from the provided row
-    flt_mjr_axis = gdf_singlerow.iloc[0]['flt_mjr_axis']
-    b_is_feet = gdf_singlerow.iloc[0]['is_feet']
-    str_input_cog_ground_dem = gdf_singlerow.iloc[0]['cog_ground_dem']
+    # get variables from the provided row (row fetched once)
+    sr_row = gdf_singlerow.iloc[0]
+    
+    flt_mjr_axis = sr_row['flt_mjr_axis']
+    b_is_feet = sr_row['is_feet']
+    str_input_cog_ground_dem = sr_row['cog_ground_dem']
     int_row_index = gdf_singlerow.index[0]
-    shp_mjr_axis_ln = gdf_singlerow.geometry.loc[int_row_index]
-
+    shp_mjr_axis_ln = sr_row['geometry']
     
-    int_index_hull = gdf_singlerow.iloc[0]['hull_idx']
-    str_major_axis_filepath = gdf_singlerow.iloc[0]['file_path']
+    int_index_hull = sr_row['hull_idx']
+    str_major_axis_filepath = sr_row['file_path']
  
     # reproject to lambert
     gdf_singlerow_lambert = gdf_singlerow.to_crs(lambert)
@@ -611,11 +791,9 @@ def fn_populate_sta_ground_deck_elev(gdf_singlerow):
     
     if os.path.exists(path_deck_dem_filepath):
 
-        # read the bridge deck DEM as a "Rioxarray"
-        deck_dem = rio.open_rasterio(path_deck_dem_filepath)
-
-        # reproject the raster to the same projection as the major axis ln
-        deck_dem_local_proj = deck_dem.rio.reproject(gdf_singlerow.crs, nodata = np.nan)
+        # read the bridge deck DEM as a "Rioxarray" - nodata as nan
+        # (not reprojected - the profile points are transformed to its crs)
+        deck_dem = rio.open_rasterio(path_deck_dem_filepath, masked=True).astype('float32', copy=False)
 
         # get geometry of major axis line in lambert
         shp_mjr_axis_ln_lambert = gdf_singlerow_lambert.geometry.loc[int_row_index]
@@ -625,30 +803,31 @@ def fn_populate_sta_ground_deck_elev(gdf_singlerow):
 
         if str_input_cog_ground_dem == 'None':
             # get the ground dem from usgs web service
-            ground_dem_local_proj = fn_get_ground_dem_from_usgs_service(shp_mjr_axis_ar_buffer_lambert,
-                                                                        b_is_feet,
-                                                                        gdf_singlerow.crs)
+            ground_dem = fn_get_ground_dem_from_usgs_service(shp_mjr_axis_ar_buffer_lambert)
         else:
-            if str_input_cog_ground_dem[:-3] == "tif":
+            if str_input_cog_ground_dem[-3:] == "tif":
                 # 2023.07.24 ... or ... get ground from provided cloud optimized geotiff
-                ground_dem_local_proj = fn_get_ground_dem_from_provided_cog(shp_mjr_axis_ar_buffer_lambert,
-                                                                            b_is_feet,
-                                                                            gdf_singlerow.crs,
-                                                                            str_input_cog_ground_dem)
+                ground_dem = fn_get_ground_dem_from_provided_cog(shp_mjr_axis_ar_buffer_lambert,
+                                                                 str_input_cog_ground_dem)
             else:
                 # use the rtree (in EPSG:3857) to get the ground dem
-                ground_dem_local_proj = fn_get_ground_dem_rtree(shp_mjr_axis_ar_buffer_lambert,
-                                                                b_is_feet,
-                                                                gdf_singlerow.crs, 
-                                                                str_input_cog_ground_dem)
+                ground_dem = fn_get_ground_dem_rtree(shp_mjr_axis_ar_buffer_lambert,
+                                                     str_input_cog_ground_dem)
         
         # added 2023.09.20 - error trapping bad dem inputs
-        if ground_dem_local_proj is not None:
+        if ground_dem is not None:
             # get a pandas dataframe of the ground and deck geometry profile
+            # the ground dems are in meters - scale the sampled values to feet
+            if b_is_feet:
+                flt_grnd_unit_conv = 3.28084
+            else:
+                flt_grnd_unit_conv = 1.0
+            
             gdf = fn_get_profile_gdf_on_major_axis_from_dems(shp_mjr_axis_ln,
                                                              str_mjr_axis_ln_crs,
-                                                             ground_dem_local_proj,
-                                                             deck_dem_local_proj)
+                                                             ground_dem,
+                                                             deck_dem,
+                                                             flt_grnd_unit_conv)
             
             # get a pandas dataframe of the smoothed cross section
             df_smooth_ground_and_deck = fn_get_smooth_deck_and_ground_profile(gdf)
@@ -656,22 +835,65 @@ def fn_populate_sta_ground_deck_elev(gdf_singlerow):
             # round all values to two decimal places
             df_smooth_ground_and_deck = df_smooth_ground_and_deck.round(2)
     
-            # add the lists as strings to the current row
+            # the lists as strings
             str_list_station = str(df_smooth_ground_and_deck['sta'].tolist())
             str_list_ground_elev = str(df_smooth_ground_and_deck['ground_elev'].tolist())
             str_list_max_elev_road_deck = str(df_smooth_ground_and_deck['max_elev_road_deck'].tolist())
     
-            # append the values to the dataframe
-            gdf_singlerow.at[int_row_index, 'sta'] = str_list_station
-            gdf_singlerow.at[int_row_index, 'ground_elv'] = str_list_ground_elev
-            gdf_singlerow.at[int_row_index, 'deck_elev'] = str_list_max_elev_road_deck
-            
-            list_str_columns_to_drop = ['flt_mjr_axis','is_feet','cog_ground_dem']
-            gdf_singlerow = gdf_singlerow.drop(columns=list_str_columns_to_drop, axis=1)
+            # only the profile values (keyed on the row index) are returned - the
+            # row itself is not sent back from the worker. Typed (float32) copies
+            # of the lists are added for the binary profile output
+            tup_profile = (int_row_index,
+                           str_list_station,
+                           str_list_ground_elev,
+                           str_list_max_elev_road_deck,
+                           df_smooth_ground_and_deck['sta'].to_numpy(dtype=np.float32),
+                           df_smooth_ground_and_deck['ground_elev'].to_numpy(dtype=np.float32),
+                           df_smooth_ground_and_deck['max_elev_road_deck'].to_numpy(dtype=np.float32))
         
-            return(gdf_singlerow)
+            return(tup_profile)
         else:
             return(None)
+    else:
+        return(None)
+# ...........................................
+
+
+# ...........................................
+def fn_populate_sta_ground_deck_elev_chunk(gdf_rows):
+    
+    # work unit of the pool - a block of major axis rows
+    # profiles each row and returns a list of the profile tuples of the
+    # rows that were profiled
+    list_tup_profiles = []
+    for int_pos in range(len(gdf_rows)):
+        tup_profile = fn_populate_sta_ground_deck_elev(gdf_rows.iloc[[int_pos]].copy())
+        
+        # added 2023.09.20 - Drop the 'None' values
+        if tup_profile is not None:
+            list_tup_profiles.append(tup_profile)
+    
+    return(list_tup_profiles)
+# ...........................................
+
+
+# ...........................................
+def fn_write_profiles_parquet(gdf_mjr_axis_xs, str_parquet_path):
+    # write the station, ground and deck profiles of each major axis as
+    # list<float32> columns of a parquet file (keyed on mjr_ax_idx)
+    # - binary alternative to parsing the string lists in the geopackage
+    list_arr_columns = ['arr_sta', 'arr_ground_elv', 'arr_deck_elev']
+    
+    table_profiles = pa.table({
+        'mjr_ax_idx': pa.array(gdf_mjr_axis_xs['mjr_ax_idx'].astype('int64')),
+        'sta': pa.array(list(gdf_mjr_axis_xs['arr_sta']), type=pa.list_(pa.float32())),
+        'ground_elv': pa.array(list(gdf_mjr_axis_xs['arr_ground_elv']), type=pa.list_(pa.float32())),
+        'deck_elev': pa.array(list(gdf_mjr_axis_xs['arr_deck_elev']), type=pa.list_(pa.float32()))})
+    
+    pq.write_table(table_profiles, str_parquet_path, compression='zstd')
+    
+    # the geopackage keeps only the string lists
+    return(gdf_mjr_axis_xs.drop(columns=list_arr_columns))
 # ...........................................
 
 
@@ -707,7 +929,7 @@ def fn_attribute_mjr_axis(str_input_dir,int_class,str_input_cog_ground_dem,
     print("===================================================================")
     
     
-    # determine if there is a 'flip_mjr_axis_w_name_ln.shp' file in 07_major_axis_names
+    # determine if there is a 'flip_mjr_axis_w_name_ln.fgb' file in 07_major_axis_names
     
     wgs = "epsg:4326"
 
@@ -721,7 +943,7 @@ def fn_attribute_mjr_axis(str_input_dir,int_class,str_input_cog_ground_dem,
     
     b_is_feet = json_run_data["b_is_feet"]
   
-    str_path_to_mjr_axis_shp = os.path.join(str_input_dir, '07_major_axis_names', 'flip_mjr_axis_w_name_ln.shp')
+    str_path_to_mjr_axis_shp = os.path.join(str_input_dir, '07_major_axis_names', 'flip_mjr_axis_w_name_ln.fgb')
     str_path_to_aoi_folder = os.path.join(str_input_dir, '00_input_shapefile')
     str_aoi_shapefile_path = ''
     
@@ -736,9 +958,6 @@ def fn_attribute_mjr_axis(str_input_dir,int_class,str_input_cog_ground_dem,
             gdf_merge = gpd.read_file(str_path_to_mjr_axis_shp)
             gdf_merge['file_path'] = str_path_to_mjr_axis_shp
             
-            # copy geometry to another coloumn
-            gdf_merge['str_geom_mjr_ln'] = gdf_merge.geometry.apply(lambda x: wkt.dumps(x))
-            
             # load the area of interst polygon
             gdf_area_of_interest = gpd.read_file(str_aoi_shapefile_path)
             
@@ -748,45 +967,32 @@ def fn_attribute_mjr_axis(str_input_dir,int_class,str_input_cog_ground_dem,
             flt_perct_on_line = 0.5 # midpoint on the line
             gdf_mjr_axis_mid_pt = fn_gdf_point_on_line(flt_perct_on_line, gdf_merge.copy())
             
-            # copy and gdf and delete all rows for appending rows later
-            gdf_appended_pts = gdf_mjr_axis_mid_pt.copy()
-            gdf_appended_pts = gdf_appended_pts[0:0]
+            # if point in center of linestring is not inside the aoi polygon(s), drop the row from the merged list
+            # all the polygons of the aoi as one (multi)polygon - prepared once
+            shp_aoi_poly = shapely.union_all(np.asarray(gdf_area_of_interest.geometry.values))
+            shapely.prepare(shp_aoi_poly)
             
-            # if point in center of linestring is not inside the aoi polygon, drop the row from the merged list
-            # pick the first polygon
-            shp_aoi_poly = gdf_area_of_interest.iloc[0]['geometry']
+            # one vectorized containment test of all the midpoint coordinates
+            arr_is_in_aoi = shapely.contains_xy(shp_aoi_poly,
+                                                gdf_mjr_axis_mid_pt.geometry.x.to_numpy(),
+                                                gdf_mjr_axis_mid_pt.geometry.y.to_numpy())
             
-            for index, row in gdf_mjr_axis_mid_pt.iterrows():
-                shp_point = row.geometry
-                
-                # if point is in polygon (shapely)
-                if shp_aoi_poly.contains(shp_point):
-                    # append this row to a new geodataframe
-                    gdf_new = gpd.GeoDataFrame(pd.DataFrame(row.to_dict(), index=[index]),
-                                               geometry="geometry",
-                                               crs = gdf_appended_pts.crs)
-                
-                    gdf_appended_pts = pd.concat([gdf_appended_pts, gdf_new])
-                
-            gdf_appended_pts.crs = gdf_merge.crs
-            
-            gdf_appended_ln = gdf_appended_pts.copy()
-            
-            gdf_appended_ln.geometry = gdf_appended_ln['str_geom_mjr_ln'].apply(loads)
-            gdf_appended_ln.drop('str_geom_mjr_ln', axis=1, inplace=True) #Drop WKT column
+            # keep the lines (same rows as the points) - no wkt copy of the geometry needed
+            gdf_appended_ln = gdf_merge[arr_is_in_aoi].copy()
             
             gdf_appended_ln['mjr_ax_idx'] = gdf_appended_ln.index
             
             # ~~~~~~~~~~~~~~~~~~~~~~~~~~~
             # determine the hull index for each major axis line
 
-            # copy and gdf and delete all rows for appending rows later
-            gdf_appended_ln_w_hull_id = gdf_appended_ln.copy()
-            gdf_appended_ln_w_hull_id = gdf_appended_ln_w_hull_id[0:0] # a blank geodataframe with fields
-            gdf_appended_ln_w_hull_id.crs = gdf_appended_ln.crs
+            # rows of each file with the hull_idx field added - combined into
+            # one geodataframe after the loop
+            list_gdf_per_file_out = []
+            list_str_columns_out = list(gdf_appended_ln.columns) + ['hull_idx']
             
-            # add the hull_idx field
-            gdf_appended_ln_w_hull_id['hull_idx'] = None
+            # hull polygons (reprojected) keyed by the hull shapefile path - several
+            # major axis files in the same folder share one hull shapefile
+            dict_hull_gdf = {}
             
             # determine the bridge hull ID for each bridge
             arr_unique_files = gdf_appended_ln.file_path.unique()
@@ -804,41 +1010,35 @@ def fn_attribute_mjr_axis(str_input_dir,int_class,str_input_cog_ground_dem,
                 
                 if os.path.exists(path_hull_shp_file):
                     
-                    gdf_bridge_hull = gpd.read_file(path_hull_shp_file)
-                    # convert the shapefile of the hull to the crs of the gdf_mjr_axis_per_file
-                    gdf_bridge_hull_reproject = gdf_bridge_hull.to_crs(gdf_mjr_axis_per_file.crs)
+                    if path_hull_shp_file not in dict_hull_gdf:
+                        gdf_bridge_hull = gpd.read_file(path_hull_shp_file)
+                        # convert the shapefile of the hull to the crs of the gdf_mjr_axis_per_file
+                        dict_hull_gdf[path_hull_shp_file] = gdf_bridge_hull.to_crs(gdf_mjr_axis_per_file.crs)
+                    
+                    gdf_bridge_hull_reproject = dict_hull_gdf[path_hull_shp_file]
                 
-                    for index, row in gdf_mjr_axis_per_file.iterrows():
-                        # get the geometry of the current major axis
-                        shp_current_mjr_axis = row['geometry']
-                        int_found_hull_index = -99
-                        
-                        for index2, row2 in gdf_bridge_hull_reproject.iterrows():
-                            # get geometry of current hull
-                            shp_current_hull = row2['geometry']
-                            
-                            shp_intersection = shp_current_hull.intersection(shp_current_mjr_axis)
-                            if shp_intersection.wkt != "LINESTRING EMPTY":
-                            #if shp_intersection.wkt != "LINESTRING Z EMPTY":
-                                # the bridge hull intersects the major axis
-                                int_found_hull_index = index2
-                                
-                        # append the 'hull_idx' to the 'row_out' pandas series
-                        s_hull_idx = pd.Series([int_found_hull_index], index=['hull_idx'])
-                        
-                        # combine row and s_hull_idx dataseries (converted to dict)
-                        dict_row_out = row.to_dict() | s_hull_idx.to_dict()
-
-                        # append this row to a new geodataframe
-                        gdf_row_out = gpd.GeoDataFrame(pd.DataFrame(dict_row_out, index=[0]),
-                                                       geometry="geometry",
-                                                       crs = gdf_appended_ln_w_hull_id.crs)
-
-                        # append the row_out to the gdf_appended_ln_w_hull_id
-                        gdf_appended_ln_w_hull_id = pd.concat([gdf_appended_ln_w_hull_id, gdf_row_out])
+                    # all (hull, major axis) pairs that intersect - one bulk query
+                    # instead of testing every pair. The tree's envelopes (AABB)
+                    # prefilter the pairs; the hulls are the query input so each
+                    # (complex) hull polygon is prepared once for the exact test
+                    arr_hull_pos, arr_ln_pos = gdf_mjr_axis_per_file.sindex.query(
+                        gdf_bridge_hull_reproject.geometry.values, predicate='intersects')
+                    
+                    # hull index for each major axis (-99 if none) - where several
+                    # hulls intersect a major axis, the last hull is kept
+                    arr_hull_idx = np.full(len(gdf_mjr_axis_per_file), -99, dtype=np.int64)
+                    np.maximum.at(arr_hull_idx, arr_ln_pos, gdf_bridge_hull_reproject.index.to_numpy()[arr_hull_pos])
+                    
+                    list_gdf_per_file_out.append(gdf_mjr_axis_per_file.assign(hull_idx=arr_hull_idx))
                         
-                    #print(gdf_appended_ln_w_hull_id)
-            gdf_appended_ln_w_hull_id = gdf_appended_ln_w_hull_id.reset_index(drop=True)
+            if len(list_gdf_per_file_out) > 0:
+                gdf_appended_ln_w_hull_id = gpd.GeoDataFrame(pd.concat(list_gdf_per_file_out, ignore_index=True),
+                                                             geometry="geometry",
+                                                             crs = gdf_appended_ln.crs)
+            else:
+                gdf_appended_ln_w_hull_id = gpd.GeoDataFrame(pd.DataFrame(columns=list_str_columns_out),
+                                                             geometry="geometry",
+                                                             crs = gdf_appended_ln.crs)
             
 
             # ~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -848,11 +1048,6 @@ def fn_attribute_mjr_axis(str_input_dir,int_class,str_input_cog_ground_dem,
             gdf_appended_ln_w_hull_id.crs = gdf_appended_ln.crs
             
             
-            # create empty coloumns
-            gdf_appended_ln_w_hull_id['sta'] = ''
-            gdf_appended_ln_w_hull_id['ground_elv'] = ''
-            gdf_appended_ln_w_hull_id['deck_elev'] = ''
-            
             # adding values for multi-processing
             gdf_appended_ln_w_hull_id['is_feet'] = b_is_feet
             gdf_appended_ln_w_hull_id['flt_mjr_axis'] = flt_mjr_axis
@@ -862,29 +1057,58 @@ def fn_attribute_mjr_axis(str_input_dir,int_class,str_input_cog_ground_dem,
             
             # TODO: add the hull geometry here - 2023.09.05
             # add the hull geometry to the record
-            gdf_appended_ln_w_hull_id = fn_add_hull_geometry_early(gdf_appended_ln_w_hull_id, int_class)
+            # (reuses the hulls already read and reprojected for the hull index)
+            gdf_appended_ln_w_hull_id = fn_add_hull_geometry_early(gdf_appended_ln_w_hull_id, int_class, dict_hull_gdf)
             
             # --------------
-            num_processors = (mp.cpu_count() - 1)
-            pool = Pool(processes = num_processors)
+            num_processors = max(mp.cpu_count() - 1, 1)
             
-            # create a list of geodataframes where each item contains one row
-            list_of_single_row_gdfs = [gpd.GeoDataFrame([row], crs=gdf_appended_ln_w_hull_id.crs) for _, row in gdf_appended_ln_w_hull_id.iterrows()]
-    
-            list_gdfs = list(tqdm.tqdm(pool.imap(fn_populate_sta_ground_deck_elev, list_of_single_row_gdfs),
-                                       total = l,
-                                       desc='Profile',
-                                       bar_format = "{desc}:({n_fmt}/{total_fmt})|{bar}| {percentage:.1f}%",
-                                       ncols=67 ))
-
-            pool.close()
-            pool.join()
+            # generator of geodataframes where each item contains a block of rows
+            # (about four blocks per processor) - one pickled work unit per block.
+            # The blocks are sliced as the pool consumes them (not held in a list)
+            int_rows_per_chunk = max(math.ceil(l / (4 * num_processors)), 1)
+            int_chunk_count = math.ceil(l / int_rows_per_chunk)
+            gen_chunk_gdfs = (gdf_appended_ln_w_hull_id.iloc[i:i + int_rows_per_chunk] for i in range(0, l, int_rows_per_chunk))
+    
+            dict_progress_bar = {'total': int_chunk_count,
+                                 'desc': 'Profile',
+                                 'bar_format': "{desc}:({n_fmt}/{total_fmt})|{bar}| {percentage:.1f}%",
+                                 'ncols': 67}
+            
+            if str_input_cog_ground_dem == 'None':
+                # ground from the WCS service - the workers mostly wait on http
+                # (GIL released) so threads are used: no fork, no pickling and
+                # one shared keep-alive session. Each call opens its own datasets.
+                with ThreadPoolExecutor(max_workers = 2 * num_processors) as executor:
+                    list_blocks = list(tqdm.tqdm(executor.map(fn_populate_sta_ground_deck_elev_chunk,
+                                                              gen_chunk_gdfs),
+                                                 **dict_progress_bar))
+            else:
+                # ground from local rasters - GDAL datasets are not thread safe
+                # and the tile reprojection is compute bound, so processes are used.
+                # Each worker opens the ground dem (COG or rtree) once at start-up
+                with Pool(processes = num_processors,
+                          initializer = fn_init_profile_worker,
+                          initargs = (str_input_cog_ground_dem,)) as pool:
+                    # results are returned as each block finishes (not in order)
+                    list_blocks = list(tqdm.tqdm(pool.imap_unordered(fn_populate_sta_ground_deck_elev_chunk,
+                                                                     gen_chunk_gdfs,
+                                                                     chunksize = 1),
+                                                 **dict_progress_bar))
             
-            # added 2023.09.20 - Drop the 'None' values
-            list_gdfs = [item for item in list_gdfs if item is not None]
+            # profile tuples of all the blocks (rows that were not profiled are not included)
+            list_tup_profiles = [tup_profile for list_block in list_blocks for tup_profile in list_block]
             
-            if len(list_gdfs) > 0:
-                gdf_appended_ln_w_hull_id = gpd.GeoDataFrame(pd.concat(list_gdfs), crs=list_gdfs[0].crs)
+            if len(list_tup_profiles) > 0:
+                df_profiles = pd.DataFrame(list_tup_profiles,
+                                           columns=['row_index', 'sta', 'ground_elv', 'deck_elev',
+                                                    'arr_sta', 'arr_ground_elv', 'arr_deck_elev']).set_index('row_index')
+                df_profiles.index.name = gdf_appended_ln_w_hull_id.index.name
+                
+                # keep only the profiled rows (in the original row order) and
+                # add the profiles in one join
+                list_str_columns_to_drop = ['flt_mjr_axis','is_feet','cog_ground_dem']
+                gdf_appended_ln_w_hull_id = gdf_appended_ln_w_hull_id.drop(columns=list_str_columns_to_drop).join(df_profiles, how='inner')
                 
                 # --------------
     
@@ -892,19 +1116,13 @@ def fn_attribute_mjr_axis(str_input_dir,int_class,str_input_cog_ground_dem,
                 # add the lat/long of the centerpoint of the major axis line
                 gdf_mjr_axis_ln_wgs = gdf_appended_ln_w_hull_id.to_crs(wgs)
                 
-                # add the lat/long coloumns
-                gdf_appended_ln_w_hull_id['latitude'] = ''
-                gdf_appended_ln_w_hull_id['longitude'] = ''
+                # -------lat / Long Coordinates of Major Axis Centeroid -----
+                # (one vectorized centroid call for all the lines)
+                arr_centroid = shapely.centroid(np.asarray(gdf_mjr_axis_ln_wgs.geometry.values))
                 
-                for index, row in gdf_mjr_axis_ln_wgs.iterrows():
-                    # -------lat / Long Coordinates of Major Axis Centeroid -----
-                    geom_wkt = row['geometry']
-                    str_lon = str(round(geom_wkt.centroid.coords[0][0], 4))
-                    str_lat = str(round(geom_wkt.centroid.coords[0][1], 4))
-                    
-                    # append the lat and long
-                    gdf_appended_ln_w_hull_id.at[index, 'latitude'] = str_lat
-                    gdf_appended_ln_w_hull_id.at[index, 'longitude'] = str_lon
+                # add the lat/long coloumns (as float64)
+                gdf_appended_ln_w_hull_id['latitude'] = np.round(shapely.get_y(arr_centroid), 4)
+                gdf_appended_ln_w_hull_id['longitude'] = np.round(shapely.get_x(arr_centroid), 4)
                 # ---------------------------
                 
                 # add the 'run' attributes to the geodataframe
@@ -925,8 +1143,18 @@ def fn_attribute_mjr_axis(str_input_dir,int_class,str_input_cog_ground_dem,
                 
                 str_major_axis_xs_file = os.path.join(str_path_xs_folder, '08_01_mjr_axis_xs.gpkg')
                 
-                # export the geopackage
-                gdf_appended_ln_w_hull_id.to_file(str_major_axis_xs_file, driver='GPKG')
+                # hull geometry to wkt text for the geopackage (one vectorized call)
+                arr_hull_wkt = shapely.to_wkt(np.asarray(gdf_appended_ln_w_hull_id['hull_geom'], dtype=object),
+                                              rounding_precision=-1)
+                gdf_appended_ln_w_hull_id['hull_geom'] = np.where(pd.isna(arr_hull_wkt), '', arr_hull_wkt)
+                gdf_appended_ln_w_hull_id = gdf_appended_ln_w_hull_id.rename(columns={'hull_geom': 'hull_wkt'})
+                
+                # typed profiles to a parquet file next to the geopackage
+                str_profiles_file = os.path.join(str_path_xs_folder, '08_01_mjr_axis_xs_profiles.parquet')
+                gdf_appended_ln_w_hull_id = fn_write_profiles_parquet(gdf_appended_ln_w_hull_id, str_profiles_file)
+                
+                # export the geopackage (batched write through pyogrio)
+                gdf_appended_ln_w_hull_id.to_file(str_major_axis_xs_file, driver='GPKG', engine='pyogrio')
                 
                 # --- running the additional sub-processes for additional attribution
                 # Assign the feature line id
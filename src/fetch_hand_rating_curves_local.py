@@ -22,12 +22,16 @@ import argparse
 import geopandas as gpd
 import pandas as pd
 
+import shapely
 from shapely.geometry import Point, mapping
 import numpy as np
 
 import json
 import configparser
 
+import pyarrow as pa
+import pyarrow.parquet as pq
+
 import warnings
 import os
 
@@ -73,26 +77,49 @@ def fn_print_progress_bar (iteration,
 
 
 # ````````````````````````````````````````
-def fn_filelist(source, tpl_extenstion):
-    # walk a directory and get files with suffix
-    # returns a list of file paths
+def fn_first_file(source, tpl_extenstion):
+    # walk a directory and get the first file with suffix (in os.walk order)
+    # returns the file path or '' if none is found
     # args:
     #   source = path to walk
     #   tpl_extenstion = tuple of the extensions to find (Example: (.tig, .jpg))
-    matches = []
-    for root, dirnames, filenames in os.walk(source):
-        for filename in filenames:
-            if filename.endswith(tpl_extenstion):
-                matches.append(os.path.join(root, filename))
-    return matches
+    # os.scandir - stops at the first match (the rest of the tree is not read)
+    tpl_extenstion = tuple(str_ext.lower() for str_ext in tpl_extenstion)
+    
+    list_dirs_to_scan = [source]
+    while list_dirs_to_scan:
+        list_subdirs = []
+        try:
+            with os.scandir(list_dirs_to_scan.pop()) as it_entries:
+                for entry in it_entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        list_subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(tpl_extenstion):
+                        return(entry.path)
+        except OSError:
+            # like os.walk - skip folders that can't be read (or don't exist)
+            continue
+        
+        # same (top-down) order as os.walk
+        list_dirs_to_scan.extend(reversed(list_subdirs))
+    return('')
 # ````````````````````````````````````````
 
 
-# ...........................................................
-def fn_merge(list1, list2):
-    merged_list = [(list1[i], list2[i]) for i in range(0, len(list1))]
-    return merged_list
-# ...........................................................
+# .....................................................
+def fn_nearest_stream(gdf_mjr_axis_ln, gdf_stream_ln):
+    # for each major axis line, get the attributes of the nearest stream line
+    # and the distance to it ('dist_river') - returned on the index of gdf_mjr_axis_ln
+    gdf_nearest = gpd.sjoin_nearest(gdf_mjr_axis_ln[['geometry']],
+                                    gdf_stream_ln,
+                                    how='left',
+                                    distance_col='dist_river')
+    
+    # on a distance tie, keep the first stream
+    gdf_nearest = gdf_nearest[~gdf_nearest.index.duplicated(keep='first')]
+    
+    return(gdf_nearest)
+# .....................................................
 
 
 # .....................................................
@@ -123,8 +150,12 @@ def fn_determine_segment_id(list_input_files, str_segment_field_name):
     tuple_aoi_extents = shp_aoi_union.bounds
 
     # Read hand stream line geopackage with bounding box filter
+    # (only the needed columns - read through pyogrio as arrow batches)
     gdf_hand_stream_nwm_prj = gpd.read_file(str_hand_stream_ln,
-                                            bbox=tuple_aoi_extents)
+                                            bbox=tuple_aoi_extents,
+                                            engine="pyogrio",
+                                            columns=['feature_id', str_segment_field_name, 'order_'],
+                                            use_arrow=True)
     
     # clip the streams to the area of interest
     # should be same crs... cleaning up to supress crs mismatch error
@@ -143,19 +174,23 @@ def fn_determine_segment_id(list_input_files, str_segment_field_name):
                                                                          'geometry']]
     
     # --- determine intersecting points between two line features ---
-    # merge all the stream lines into one shapely object
-    shp_hand_stream_merge = gdf_hand_stream_in_aoi_input_prj.geometry.unary_union
+    # (stream, major axis) pairs that intersect - one bulk query on the
+    # spatial index of the major axis lines instead of unioning both line sets
+    arr_stream_pos, arr_mjr_axis_pos = gdf_mjr_axis_ln.sindex.query(gdf_hand_stream_in_aoi_input_prj.geometry.values,
+                                                                    predicate='intersects')
     
-    # merge all the major axis lines into one shapely object
-    shp_mjr_axis_ln = gdf_mjr_axis_ln.geometry.unary_union
-    
-    
-    # intersect the two shapely line groups
-    shp_intersection_pt = shp_hand_stream_merge.intersection(shp_mjr_axis_ln)
+    # intersect each pair of lines and keep the points
+    arr_intersection = shapely.intersection(gdf_hand_stream_in_aoi_input_prj.geometry.values[arr_stream_pos],
+                                            gdf_mjr_axis_ln.geometry.values[arr_mjr_axis_pos])
+    arr_intersection_parts = shapely.get_parts(arr_intersection)
+    arr_intersection_pt = arr_intersection_parts[shapely.get_type_id(arr_intersection_parts) == 0]
     
     b_have_points = False
     
-    if shp_intersection_pt.geom_type == 'MultiPoint' or shp_intersection_pt.geom_type == 'Point':
+    if len(arr_intersection_pt) > 0:
+        # union of the points - removes duplicates (where streams meet on a major axis)
+        shp_intersection_pt = shapely.union_all(arr_intersection_pt)
+        
         gs_multipoints = gpd.GeoSeries(shp_intersection_pt)
         gs_points = gs_multipoints.explode(index_parts=False)
         
@@ -166,32 +201,26 @@ def fn_determine_segment_id(list_input_files, str_segment_field_name):
         gdf_points = gdf_points.reset_index(drop=True)
         b_have_points = True
     
-    # buffer to get stream attributes on points
-    gdf_hand_stream_in_aoi_input_prj_buffer = gdf_hand_stream_in_aoi_input_prj.copy()
-    gdf_hand_stream_in_aoi_input_prj_buffer['geometry'] = gdf_hand_stream_in_aoi_input_prj_buffer.geometry.buffer(0.1)
-    
     if b_have_points:
-        # Spatial join of the points and buffered stream
+        # Spatial join of the points and streams within 0.1 (no buffer polygons built)
         gdf_intersection_points_feature_id = gpd.sjoin(
             gdf_points,
-            gdf_hand_stream_in_aoi_input_prj_buffer,
+            gdf_hand_stream_in_aoi_input_prj,
             how='left',
-            op='intersects')
+            predicate='dwithin',
+            distance=0.1)
         
         # delete index_right
         del gdf_intersection_points_feature_id['index_right']
         
         
-        # buffer the major axis lines to get attributes on points
-        gdf_mjr_axis_ln_buffer = gdf_mjr_axis_ln.copy()
-        gdf_mjr_axis_ln_buffer['geometry'] = gdf_mjr_axis_ln_buffer.geometry.buffer(0.1)
-        
-        # Spatial join the 'feature_id' attributed streams points with the buffers major axis
+        # Spatial join the 'feature_id' attributed streams points with the major axis lines within 0.1
         gdf_intersection_points_major_axis = gpd.sjoin(
             gdf_intersection_points_feature_id,
-            gdf_mjr_axis_ln_buffer,
+            gdf_mjr_axis_ln,
             how='left',
-            op='intersects')
+            predicate='dwithin',
+            distance=0.1)
         
         # delete index_right
         del gdf_intersection_points_major_axis['index_right']
@@ -205,21 +234,10 @@ def fn_determine_segment_id(list_input_files, str_segment_field_name):
         if len(gdf_duplicates) > 1:
             # there should be at least two rows
             
-            # get a list of unique uuid of the duplicates
-            arr_unique_uuid_duplicates = gdf_duplicates.uuid.unique()
-            
-            list_index_to_keep = []
-        
-            for x in arr_unique_uuid_duplicates:
-                # dataframe of just the matching rows
-                gdf_matching = gdf_duplicates.loc[gdf_duplicates['uuid'] == x]
-        
-                # determine the highest stream order
-                # if stream orders are all the same... it just picks the first value
-                # TODO - 2022.10.07 - Do we want the biggest drainage area?
-                max_index = gdf_matching['order__right'].idxmax()
-        
-                list_index_to_keep.append(max_index)
+            # index of the highest stream order of each uuid (one groupby pass)
+            # if stream orders are all the same... it just picks the first value
+            # TODO - 2022.10.07 - Do we want the biggest drainage area?
+            list_index_to_keep = gdf_duplicates.groupby('uuid', sort=False)['order__right'].idxmax().tolist()
         
             # list of all the gdf_duplicates indecies
             list_all_index = gdf_duplicates.index.tolist()
@@ -251,30 +269,21 @@ def fn_determine_segment_id(list_input_files, str_segment_field_name):
         gdf_crosses_stream = gdf_stream_merge_crossing[gdf_stream_merge_crossing[str_segment_field_name ].notna()]
         
         # dataframe where a str_segment_field_name was not assigned -- str_segment_field_name is null
-        gdf_find_nearest_stream = gdf_stream_merge_crossing[gdf_stream_merge_crossing[str_segment_field_name ].isna()]
+        gdf_find_nearest_stream = gdf_stream_merge_crossing[gdf_stream_merge_crossing[str_segment_field_name ].isna()].copy()
         
         # --- when a major axis line does not intersect a stream line
         # if no match found, search for the nearest stream and populate str_segment_field_name and search distance
-    
-        for index, row in gdf_find_nearest_stream.iterrows():
-            # get the the nearest stream in gdf_stream_in_aoi_prj
-            pd_dist_to_nearest_stream = gdf_hand_stream_in_aoi_input_prj.distance(row['geometry']).sort_values()
-            
-            # distance to nearest stream
-            flt_nearest_stream_dist = pd_dist_to_nearest_stream.iloc[0]
-            
-            # index in gdf_stream_in_aoi_prj of nearest stream
-            int_nearest_stream_index = gdf_hand_stream_in_aoi_input_prj.distance(row['geometry']).sort_values().index[0]
-            
-            # append gdf_mjr_axis_ln with the 'feature_id', 'order_' and 'dist_river' of the nearest stream line
-            
-            gdf_find_nearest_stream.at[index, str_segment_field_name ] = gdf_hand_stream_in_aoi_input_prj.loc[int_nearest_stream_index][str_segment_field_name]
-            gdf_find_nearest_stream.at[index, 'order__left'] = gdf_hand_stream_in_aoi_input_prj.loc[int_nearest_stream_index]['order_']
-            gdf_find_nearest_stream.at[index, 'dst_new_rv'] = round(flt_nearest_stream_dist, 2)
-            gdf_find_nearest_stream.at[index, 'feature_id_right'] = gdf_hand_stream_in_aoi_input_prj.loc[int_nearest_stream_index]['feature_id']
-            
-        # combine the gdf_find_nearest_stream and gdf_crosses_stream
-        gdf_mjr_axis_ln_attributed = pd.concat([gdf_find_nearest_stream, gdf_crosses_stream])
+        # (one nearest neighbor join for all the lines - uses the stream spatial index)
+        gdf_nearest = fn_nearest_stream(gdf_find_nearest_stream, gdf_hand_stream_in_aoi_input_prj)
+        
+        # append gdf_mjr_axis_ln with the 'feature_id', 'order_' and 'dist_river' of the nearest stream line
+        gdf_find_nearest_stream[str_segment_field_name] = gdf_nearest[str_segment_field_name]
+        gdf_find_nearest_stream['order__left'] = gdf_nearest['order_']
+        gdf_find_nearest_stream['dst_new_rv'] = gdf_nearest['dist_river'].round(2)
+        gdf_find_nearest_stream['feature_id_right'] = gdf_nearest['feature_id']
+        
+        # combine the gdf_find_nearest_stream and gdf_crosses_stream (new index - no alignment)
+        gdf_mjr_axis_ln_attributed = pd.concat([gdf_find_nearest_stream, gdf_crosses_stream], ignore_index=True)
     
     else:
         # no intersecting points were found
@@ -288,22 +297,12 @@ def fn_determine_segment_id(list_input_files, str_segment_field_name):
         gdf_mjr_axis_ln_attributed['feature_id_right'] = ''
         
         
-        for index, row in gdf_mjr_axis_ln_attributed.iterrows():
-            # get the the nearest stream in gdf_stream_in_aoi_prj
-            pd_dist_to_nearest_stream = gdf_hand_stream_in_aoi_input_prj.distance(row['geometry']).sort_values()
-            
-            # distance to nearest stream
-            flt_nearest_stream_dist = pd_dist_to_nearest_stream.iloc[0]
-            
-            # index in gdf_stream_in_aoi_prj of nearest stream
-            int_nearest_stream_index = gdf_hand_stream_in_aoi_input_prj.distance(row['geometry']).sort_values().index[0]
-            
-            # append gdf_mjr_axis_ln with the 'feature_id', 'order_' and 'dist_river' of the nearest stream line
-            
-            gdf_mjr_axis_ln_attributed.at[index, str_segment_field_name] = gdf_hand_stream_in_aoi_input_prj.loc[int_nearest_stream_index][str_segment_field_name]
-            gdf_mjr_axis_ln_attributed.at[index, 'dist_river'] = round(flt_nearest_stream_dist, 2)
-            gdf_mjr_axis_ln_attributed.at[index, 'feature_id_right'] = gdf_hand_stream_in_aoi_input_prj.loc[int_nearest_stream_index]['feature_id']
-            
+        gdf_nearest = fn_nearest_stream(gdf_mjr_axis_ln_attributed, gdf_hand_stream_in_aoi_input_prj)
+        
+        # append gdf_mjr_axis_ln with the 'feature_id', 'order_' and 'dist_river' of the nearest stream line
+        gdf_mjr_axis_ln_attributed[str_segment_field_name] = gdf_nearest[str_segment_field_name]
+        gdf_mjr_axis_ln_attributed['dist_river'] = gdf_nearest['dist_river'].round(2)
+        gdf_mjr_axis_ln_attributed['feature_id_right'] = gdf_nearest['feature_id']
             
     # convert 'feature_id' to integer
     gdf_mjr_axis_ln_attributed['feature_id_right'] = gdf_mjr_axis_ln_attributed['feature_id_right'].astype(int)
@@ -314,6 +313,20 @@ def fn_determine_segment_id(list_input_files, str_segment_field_name):
 # .....................................................
 
 
+# ...........................................................
+def fn_write_rating_curves_parquet(list_str_uuid, list_tup_hand_r_arrays, str_parquet_path):
+    # write the rating curve of each major axis as list<float32> columns of
+    # discharge (cfs) and stage (ft) in a parquet file (keyed on uuid)
+    # - the geopackage and geojson keep only the 'uuid' key of each rating curve
+    table_rating_curves = pa.table({
+        'uuid': pa.array(list_str_uuid, type=pa.string()),
+        'discharge_cfs': pa.array([tup[0] for tup in list_tup_hand_r_arrays], type=pa.list_(pa.float32())),
+        'stage_ft': pa.array([tup[1] for tup in list_tup_hand_r_arrays], type=pa.list_(pa.float32()))})
+    
+    pq.write_table(table_rating_curves, str_parquet_path, compression='zstd')
+# ...........................................................
+
+
 # ------------------------------------------------------
 def fn_fetch_hand_rating_curves(str_input_dir,str_hand_stream_ln_gpkg,str_hydro_table_parquet,str_segment_field_name):
     print('Getting HAND segment rating curves from parquet (~20 sec)...')
@@ -322,12 +335,9 @@ def fn_fetch_hand_rating_curves(str_input_dir,str_hand_stream_ln_gpkg,str_hydro_
     str_major_axis_lines = os.path.join(str_input_dir, '08_cross_sections', '08_07_mjr_axis_xs_w_feature_id_nbi_low_hull.gpkg')
     
     str_path_to_aoi_folder = os.path.join(str_input_dir, '00_input_shapefile')
-    str_aoi_ar = ''
     
-    # find a shapefile in the str_path_to_aoi_folder and get list
-    list_shapefiles = fn_filelist(str_path_to_aoi_folder, ('.SHP', '.shp'))
-    if len(list_shapefiles) > 0:
-        str_aoi_ar = list_shapefiles[0]
+    # find the first shapefile in the str_path_to_aoi_folder
+    str_aoi_ar = fn_first_file(str_path_to_aoi_folder, ('.shp',))
         
     list_input_files = [str_major_axis_lines, str_aoi_ar, str_hand_stream_ln_gpkg, str_hydro_table_parquet]
     
@@ -362,42 +372,52 @@ def fn_fetch_hand_rating_curves(str_input_dir,str_hand_stream_ln_gpkg,str_hydro_
             list_int_segment_field_name.append(-1)
             
     # ---------
-    # reading the parquet hydrotable
+    # reading the parquet hydrotable - only the needed columns and the rows of
+    # the segments that were found (filter is pushed down to the row groups)
     print('Finding Rating Curves...')
-    df_hydro_table = pd.read_parquet(str_hydro_table_parquet)
+    list_int_segment_to_read = sorted(set(x for x in list_int_segment_field_name if x >= 0))
+    list_str_hydro_columns = [str_segment_field_name, 'stage', 'discharge_cms']
     
-    list_empty = []
-    list_of_strings = []
+    if len(list_int_segment_to_read) > 0:
+        df_hydro_table = pd.read_parquet(str_hydro_table_parquet,
+                                         columns=list_str_hydro_columns,
+                                         filters=[(str_segment_field_name, 'in', list_int_segment_to_read)])
+    else:
+        df_hydro_table = pd.DataFrame(columns=list_str_hydro_columns)
+    
+    # typed (float32) discharge and stage arrays of each segment id - one
+    # groupby pass over the hydrotable. Streams sharing a segment id reuse them
+    dict_hand_r_arrays = {}
+    
+    # the group index is built once - it gives the segment count and the groups
+    gb_hydro_segment = df_hydro_table.groupby(str_segment_field_name, sort=False)
     
     int_count = 0
-    l = len(list_int_segment_field_name)
+    l = gb_hydro_segment.ngroups
     
-    str_prefix = "Stream " + str(int_count) + ' of ' + str(l)
-    fn_print_progress_bar(0, l, prefix = str_prefix , suffix = 'Complete', length = 29)
+    if l > 0:
+        str_prefix = "Segment " + str(int_count) + ' of ' + str(l)
+        fn_print_progress_bar(0, l, prefix = str_prefix , suffix = 'Complete', length = 29)
     
-    for int_index in list_int_segment_field_name:
+    for int_segment, df_group in gb_hydro_segment:
         
         int_count += 1
-        str_prefix = "Stream " + str(int_count) + ' of ' + str(l)
-        fn_print_progress_bar(int_count, l, prefix = str_prefix , suffix = 'Complete', length = 29)
         
-        if int_index < 0:
-            str_current = str(list_empty)
-        else:
-            df_hydro_id = df_hydro_table.loc[df_hydro_table[str_segment_field_name] == int_index]
-    
-            list_stage = df_hydro_id['stage'].tolist()
-            list_discharge = df_hydro_id['discharge_cms'].tolist()
-    
-            list_stage_ft = [round(x * 3.28084,1) for x in list_stage]
-            list_discharge_cfs = [round(x * 35.314666212661,1) for x in list_discharge]
-    
-            list_of_tuples = fn_merge(list_discharge_cfs, list_stage_ft)
-            str_current = str(list_of_tuples)
-        list_of_strings.append(str_current)
+        # only redraw the progress bar when the percent changes
+        if (int_count * 100) // l != ((int_count - 1) * 100) // l:
+            str_prefix = "Segment " + str(int_count) + ' of ' + str(l)
+            fn_print_progress_bar(int_count, l, prefix = str_prefix , suffix = 'Complete', length = 29)
+        
+        # convert the units of the whole rating curve at once
+        arr_stage_ft = np.round(df_group['stage'].to_numpy() * 3.28084, 1)
+        arr_discharge_cfs = np.round(df_group['discharge_cms'].to_numpy() * 35.314666212661, 1)
+        
+        dict_hand_r_arrays[int_segment] = (arr_discharge_cfs.astype(np.float32), arr_stage_ft.astype(np.float32))
     
-    # --- append the rating curve to a new coloumn
-    gdf_returned['hand_r'] = list_of_strings
+    # rating curve arrays of each stream (empty where there is no segment id (-1)
+    # or no rows in the hydrotable)
+    tup_empty_arrays = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32))
+    list_tup_hand_r_arrays = [dict_hand_r_arrays.get(int_index, tup_empty_arrays) for int_index in list_int_segment_field_name]
     
     print('Saving output...')
     
@@ -410,15 +430,19 @@ def fn_fetch_hand_rating_curves(str_input_dir,str_hand_stream_ln_gpkg,str_hydro_
     str_major_axis_xs_file = os.path.join(str_path_xs_folder, '08_08_mjr_axis_xs_w_feature_id_nbi_low_hull_rating.gpkg')
     
     # export the geopackage
-    gdf_returned.to_file(str_major_axis_xs_file, driver='GPKG')
+    gdf_returned.to_file(str_major_axis_xs_file, driver='GPKG', engine="pyogrio")
+    
+    # rating curves to a parquet file next to the geopackage (keyed on 'uuid')
+    str_rating_curves_file = os.path.join(str_path_xs_folder, '08_08_rating_curves.parquet')
+    fn_write_rating_curves_parquet(gdf_returned['uuid'].tolist(), list_tup_hand_r_arrays, str_rating_curves_file)
     
     # export the geojson
     str_major_axis_xs_file = os.path.join(str_path_xs_folder, '08_08_mjr_axis_xs_w_feature_id_nbi_low_hull_rating.geojson')
-    gdf_returned.to_file(str_major_axis_xs_file, driver='GeoJSON')
+    gdf_returned.to_file(str_major_axis_xs_file, driver='GeoJSON', engine="pyogrio")
     
     # export the stream segments
     str_stream_segments_file = os.path.join(str_path_xs_folder, '08_09_stream_segements.geojson')
-    gdf_hand_stream_in_aoi_input_prj.to_file(str_stream_segments_file, driver='GeoJSON')
+    gdf_hand_stream_in_aoi_input_prj.to_file(str_stream_segments_file, driver='GeoJSON', engine="pyogrio")
 # ------------------------------------------------------
 
 